@@ -14,20 +14,66 @@ Standards:
     - Google's style guide for doc strings.
 """
 import unittest
+from collections import defaultdict, namedtuple
 
 import numpy as np
 
+from stacker_numba import drop_down_sweep, insertion_argsort, make_overlap_pairs
+
+# Axis aligned bounds, with lo and hi holding the min and max of each spacial axis.
+# Either a single bound with arrays of shape (3,), or many bounds with arrays of shape
+# (num_bounds, 3). Like Blender, single precision floats are precise enough, so results
+# are single precision unless the given bounds need more.
+Bounds = namedtuple("Bounds", ["lo", "hi"])
+
+# For each axis, the two other axes.
+_OTHER = ((1, 2), (0, 2), (0, 1))
+
+# For each axis, a pairwise overlap test of the two other axes.
+_OVERLAP_PAIRS = tuple(make_overlap_pairs(*other) for other in _OTHER)
+
+# Below this many values an insertion sort beats np.argsort.
+_SMALL_SORT = 32
+
+
+def empty_bounds(num_bounds):
+    """
+    Returns uninitialised bounds to be filled in.
+
+    Arguments:
+        num_bounds: The number of bounds.
+    """
+    return Bounds(
+        np.empty((num_bounds, 3), dtype=np.float32),
+        np.empty((num_bounds, 3), dtype=np.float32),
+    )
+
+
+def _argsort(values):
+    """
+    Returns the indices that would sort the given values.
+
+    Arguments:
+        values: A np.array of shape (num_values,).
+    """
+    if len(values) <= _SMALL_SORT:
+        return insertion_argsort(values)
+    return np.argsort(values, kind="quicksort")
+
 
 def get_base(bounds, axis):
     """
     Returns the bound with the lowest start value in the given axis.
 
     Arguments:
-        bounds: A np.array of shape (num_bounds, 3, 2).
+        bounds: A Bounds of shape (num_bounds, 3).
         axis:   0, 1, or 2 for x, y, z.
+
+    Returns:
+        A Bounds of shape (3,), as views into the given bounds.
     """
-    idx = np.argmin(bounds[:, axis, 0])
-    return bounds[idx]
+    idx = bounds.lo[:, axis].argmin()
+    return Bounds(bounds.lo[idx], bounds.hi[idx])
 
 
 def argsort_by_area(bounds, axis):
@@ -37,14 +83,16 @@ def argsort_by_area(bounds, axis):
     The area is determined by treating the given axis as having zero length.
 
     Arguments:
-        bounds: A np.array of shape (num_bounds, 3, 2).
+        bounds: A Bounds of shape (num_bounds, 3).
         axis:   0, 1, or 2 for x, y, z.
     """
-    dimensions = bounds[:, :, 1] - bounds[:, :, 0]
-    volume = np.prod(dimensions, 1)
-    area = volume / dimensions[:, axis]
+    dimensions = bounds.hi - bounds.lo
 
-    return np.argsort(area)
+    # multiply the other two dimensions directly rather than dividing the volume
+    first, second = _OTHER[axis]
+    area = dimensions[:, first] * dimensions[:, second]
+
+    return _argsort(area)
 
 
 def argsort_by_height(bounds, axis):
@@ -52,10 +100,10 @@ def argsort_by_height(bounds, axis):
     Returns the given bounds sorted by height, lowest first.
 
     Arguments:
-        bounds: A np.array of shape (num_bounds, 3, 2).
+        bounds: A Bounds of shape (num_bounds, 3).
         axis:   0, 1, or 2 for x, y, z.
     """
-    return np.argsort(bounds[:, axis, 0])
+    return _argsort(bounds.lo[:, axis])
 
 
 def stack_above(base_bounds, incoming_bounds, axis, padding=0, centering=True):
@@ -64,8 +112,8 @@ def stack_above(base_bounds, incoming_bounds, axis, padding=0, centering=True):
     be stacked on top of the given base bounds.
 
     Arguments:
-        base_bounds:     A np.array of shape (3, 2).
-        incoming_bounds: A np.array of shape (3, 2).
+        base_bounds:     A Bounds of shape (3,).
+        incoming_bounds: A Bounds of shape (3,).
         axis:            0, 1, or 2 for x, y, z.
         padding:         (optional) Extra space to put between each object.
         centering:       (optional) Defaults to centering the incoming bounds over the
@@ -73,40 +121,139 @@ def stack_above(base_bounds, incoming_bounds, axis, padding=0, centering=True):
     """
     if centering:
         # Use the center of each bound as a reference
-        source = np.mean(incoming_bounds, axis=-1)
-        target = np.mean(base_bounds, axis=-1)
+        source = (incoming_bounds.lo + incoming_bounds.hi) / 2
+        target = (base_bounds.lo + base_bounds.hi) / 2
     else:
         # Just use incoming's original position
-        source = incoming_bounds[:, 0].copy()
+        source = incoming_bounds.lo.copy()
         target = source.copy()
 
     # Bottom of incoming should be at top of base
-    source[axis] = incoming_bounds[axis][0]  # bottom
-    target[axis] = base_bounds[axis][1]  # top
+    source[axis] = incoming_bounds.lo[axis]  # bottom
+    target[axis] = base_bounds.hi[axis]  # top
 
     target[axis] += padding
 
     return target - source
 
 
+def stack_all_above(base_bounds, bounds, axis, padding=0, centering=True):
+    """
+    Returns the amount that each of the given bounds should be translated by in order
+    to be stacked in single file on top of the given base bounds, in the order given.
+
+    This is the same as calling stack_above on each of the given bounds in turn, with
+    the previous bound (after translation) as the base.
+
+    Arguments:
+        base_bounds: A Bounds of shape (3,).
+        bounds:      A Bounds of shape (num_bounds, 3).
+        axis:        0, 1, or 2 for x, y, z.
+        padding:     (optional) Extra space to put between each object.
+        centering:   (optional) Defaults to centering each of the bounds over the given
+                     base; pass False to disable.
+
+    Returns:
+        A np.array of shape (num_bounds, 3).
+    """
+    if centering:
+        # Every center ends up over the center of the base
+        output = (base_bounds.lo + base_bounds.hi) / 2 - (bounds.lo + bounds.hi) / 2
+    else:
+        output = np.zeros(bounds.lo.shape, dtype=np.result_type(bounds.lo, np.float32))
+
+    # Bottom of each should be at the top of everything stacked before it
+    heights = bounds.hi[:, axis] - bounds.lo[:, axis]
+    paddings = padding * np.arange(1, len(heights) + 1)
+    bottoms = base_bounds.hi[axis] + paddings + np.cumsum(heights) - heights
+
+    output[:, axis] = bottoms - bounds.lo[:, axis]
+
+    return output
+
+
 def is_below(bounds_a, bounds_b, axis):
     """
     Returns True if the first given bound is anywhere below (ie in the shadow of) the
     second given bound, and False otherwise.
 
     Arguments:
-        bounds_a: A np.array of shape (3, 2).
-        bounds_b: A np.array of shape (3, 2).
+        bounds_a: A Bounds of shape (3,).
+        bounds_b: A Bounds of shape (3,).
         axis:     0, 1, or 2 for x, y, z.
     """
+    # compare plain floats, which is much cheaper than comparing numpy scalars
+    lo_a, hi_a = bounds_a.lo.tolist(), bounds_a.hi.tolist()
+    lo_b, hi_b = bounds_b.lo.tolist(), bounds_b.hi.tolist()
+
     # simple bounding box collision for other axes
-    collision = (bounds_b[:, 0] < bounds_a[:, 1]) & (bounds_b[:, 1] > bounds_a[:, 0])
-    collision |= (bounds_b[:, 1] > bounds_a[:, 0]) & (bounds_b[:, 0] < bounds_a[:, 1])
+    for other in _OTHER[axis]:
+        if lo_b[other] >= hi_a[other] or hi_b[other] <= lo_a[other]:
+            return False
 
-    # set given axis to True if anywhere below or colliding
-    collision[axis] = bounds_b[axis, 1] >= bounds_a[axis, 0]
+    # anywhere below or colliding in the given axis
+    return hi_b[axis] >= lo_a[axis]
 
-    return all(collision)
+
+def get_shadows(bounds, axis):
+    """
+    Returns which bounds overlap each other when viewed head-on from the given axis, ie.
+    which bounds could possibly be in the shadow of others.
+
+    Bounds are first bucketed into a uniform grid so that only bounds sharing a cell
+    are tested against each other.
+
+    Arguments:
+        bounds: A Bounds of shape (num_bounds, 3).
+        axis:   0, 1, or 2 for x, y, z.
+
+    Returns:
+        A tuple of np.arrays (indptr, indices) in compressed sparse row format, where
+        the bounds overlapping bound i are indices[indptr[i]:indptr[i + 1]].
+    """
+    other_axes = list(_OTHER[axis])
+    lo = bounds.lo[:, other_axes]
+    hi = bounds.hi[:, other_axes]
+    num_bounds = len(lo)
+
+    # cells about the size of a typical bound, but no more than num_bounds cells total
+    origin = lo.min(axis=0)
+    extent = (hi.max(axis=0) - origin).max()
+    cell_size = max(np.median(hi - lo), extent / np.ceil(np.sqrt(num_bounds)))
+    if cell_size <= 0:
+        cell_size = 1.0
+
+    first_cells = ((lo - origin) // cell_size).astype(int)
+    last_cells = ((hi - origin) // cell_size).astype(int)
+
+    cells = defaultdict(list)
+    for i in range(num_bounds):
+        for x in range(first_cells[i, 0], last_cells[i, 0] + 1):
+            for y in range(first_cells[i, 1], last_cells[i, 1] + 1):
+                cells[x, y].append(i)
+
+    # every pair sharing a cell, written straight into one preallocated buffer
+    pairs = np.empty(sum(len(members) ** 2 for members in cells.values()), dtype=int)
+    start = 0
+    for members in cells.values():
+        members = np.asarray(members)
+        end = start + len(members) ** 2
+        block = pairs[start:end].reshape(len(members), len(members))
+        np.add.outer(members * num_bounds, members, out=block)
+        start = end
+
+    # without duplicates, sorted by row
+    rows, cols = np.divmod(np.unique(pairs), num_bounds)
+
+    # simple bounding box collision for each pair, ignoring the given axis
+    overlap = _OVERLAP_PAIRS[axis](bounds.lo, bounds.hi, rows, cols)
+    rows = rows[overlap]
+    cols = cols[overlap]
+
+    indptr = np.zeros(num_bounds + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_bounds), out=indptr[1:])
+
+    return indptr, cols.astype(np.int64)
 
 
 def drop_down(bounds, axis, padding=0):
@@ -115,34 +262,25 @@ def drop_down(bounds, axis, padding=0):
     be stacked on top of other bounds appearing directly below them.
 
     Arguments:
-        bounds:  A np.array of shape (num_bounds, 3, 2).
+        bounds:  A Bounds of shape (num_bounds, 3).
         axis:    0, 1, or 2 for x, y, z.
         padding: (optional) Extra space to put between each object.
     """
-    bounds = bounds.copy()
-
     idxs = argsort_by_height(bounds, axis)
-
-    floor = bounds[idxs[0]].copy()
-    floor[:, 1] = floor[:, 0]  # make flat
-
-    output = np.zeros((len(bounds), 3))
-    for idx in range(1, len(idxs)):
-        i = idxs[idx]
-
-        source = bounds[i]
-
-        candidates = [bounds[j] for j in idxs[:idx]]
-        candidates = [b for b in candidates if is_below(b, source, axis)]
-        candidates = np.asarray([floor] + list(candidates))
-
-        target = candidates[np.argmax(candidates[:, axis, 1])]
-
-        output[i] = stack_above(target, source, axis, centering=False)
-        if not np.array_equal(target, floor):
-            output[i, axis] += padding
-
-        bounds[i] = translate_bounds(bounds[i], output[i])
+    indptr, indices = get_shadows(bounds, axis)
+
+    # only the given axis changes as bounds are dropped, so the sweep reads that column
+    # of the bounds as they are and tracks positions through the output alone
+    output = np.zeros((len(bounds.lo), 3), dtype=np.result_type(bounds.lo, np.float32))
+    drop_down_sweep(
+        bounds.lo[:, axis],
+        bounds.hi[:, axis],
+        indptr,
+        indices,
+        idxs,
+        float(padding),
+        output[:, axis],
+    )
 
     return output
 
@@ -152,10 +290,10 @@ def translate_bounds(bounds, delta):
     Returns new bounds translated by the given delta.
 
     Arguments:
-        bounds: A np.array of shape (3, 2).
+        bounds: A Bounds of shape (3,) or (num_bounds, 3).
         delta:  A np.array of shape (3,).
     """
-    return bounds + np.tile(delta, (2, 1)).T
+    return Bounds(bounds.lo + delta, bounds.hi + delta)
 
 
 class TestStacker(unittest.TestCase):
@@ -163,11 +301,20 @@ class TestStacker(unittest.TestCase):
     Tests for this module.
     """
 
+    @staticmethod
+    def make_bounds(array):
+        """
+        Returns Bounds from an array of shape (..., 3, 2) where the last dimension is
+        min, max.
+        """
+        array = np.asarray(array)
+        return Bounds(array[..., 0], array[..., 1])
+
     def test_get_base(self):
         """
         Test getting the base.
         """
-        bounds = np.asarray(
+        bounds = self.make_bounds(
             [
                 [[1, 3], [1, 3], [1, 3]],
                 [[1, 3], [3, 4], [2, 3]],
@@ -177,16 +324,21 @@ class TestStacker(unittest.TestCase):
         )
 
         actual = get_base(bounds, 2)
-        expected = [[1, 2], [3, 7], [0, 4]]
+        expected = self.make_bounds([[1, 2], [3, 7], [0, 4]])
 
-        np.testing.assert_equal(actual, expected)
+        np.testing.assert_equal(actual.lo, expected.lo)
+        np.testing.assert_equal(actual.hi, expected.hi)
+
+        # no copies
+        self.assertTrue(np.shares_memory(actual.lo, bounds.lo))
+        self.assertTrue(np.shares_memory(actual.hi, bounds.hi))
 
     def test_stack_above(self):
         """
         Test that objects are stacked correctly.
         """
-        base_bounds = np.asarray([[1, 2], [3, 4], [5, 6]])
-        incoming_bounds = np.asarray([[10, 11], [12, 13], [14, 15]])
+        base_bounds = self.make_bounds([[1, 2], [3, 4], [5, 6]])
+        incoming_bounds = self.make_bounds([[10, 11], [12, 13], [14, 15]])
 
         actual = stack_above(base_bounds, incoming_bounds, 0)
         expected = np.asarray([-8, -9, -9])
@@ -204,8 +356,8 @@ class TestStacker(unittest.TestCase):
         """
         Test that objects are stacked correctly when centering is disabled.
         """
-        base_bounds = np.asarray([[1, 2], [3, 4], [5, 6]])
-        incoming_bounds = np.asarray([[10, 11], [12, 13], [14, 15]])
+        base_bounds = self.make_bounds([[1, 2], [3, 4], [5, 6]])
+        incoming_bounds = self.make_bounds([[10, 11], [12, 13], [14, 15]])
 
         actual = stack_above(base_bounds, incoming_bounds, 0, centering=False)
         expected = np.asarray([-8, 0, 0])
@@ -223,8 +375,8 @@ class TestStacker(unittest.TestCase):
         """
         Test that objects are stacked with padding.
         """
-        base_bounds = np.asarray([[1, 2], [3, 4], [5, 6]])
-        incoming_bounds = np.asarray([[10, 11], [12, 13], [14, 15]])
+        base_bounds = self.make_bounds([[1, 2], [3, 4], [5, 6]])
+        incoming_bounds = self.make_bounds([[10, 11], [12, 13], [14, 15]])
 
         actual = stack_above(base_bounds, incoming_bounds, 2, padding=0)
         expected = np.asarray([-9, -9, -8])
@@ -234,23 +386,67 @@ class TestStacker(unittest.TestCase):
         expected = np.asarray([-9, -9, -7])
         np.testing.assert_equal(actual, expected)
 
+    def test_stack_all_above(self):
+        """
+        Test that stacking many objects matches stacking them one at a time.
+        """
+        base_bounds = self.make_bounds([[1, 2], [3, 4], [5, 6]])
+        bounds = self.make_bounds(
+            [
+                [[10, 11], [12, 13], [14, 15]],
+                [[0, 4], [2, 3], [1, 3]],
+                [[-3, -1], [6, 9], [7, 12]],
+            ]
+        )
+
+        for axis in range(3):
+            for padding in [0, 1]:
+                for centering in [True, False]:
+                    actual = stack_all_above(
+                        base_bounds, bounds, axis, padding, centering
+                    )
+
+                    prev = base_bounds
+                    for i, (lo, hi) in enumerate(zip(*bounds)):
+                        incoming_bounds = Bounds(lo, hi)
+                        expected = stack_above(
+                            prev, incoming_bounds, axis, padding, centering
+                        )
+                        prev = translate_bounds(incoming_bounds, expected)
+
+                        np.testing.assert_equal(actual[i], expected)
+
     def test_translate_bounds(self):
         """
         Test that bounds are translated correctly.
         """
-        bounds = np.asarray([[1, 2], [3, 4], [5, 6]])
+        bounds = self.make_bounds([[1, 2], [3, 4], [5, 6]])
         delta = np.asarray([7, 8, 9])
 
         actual = translate_bounds(bounds, delta)
-        expected = np.asarray([[8, 9], [11, 12], [14, 15]])
+        expected = self.make_bounds([[8, 9], [11, 12], [14, 15]])
 
-        np.testing.assert_equal(actual, expected)
+        np.testing.assert_equal(actual.lo, expected.lo)
+        np.testing.assert_equal(actual.hi, expected.hi)
+
+    def test_argsort(self):
+        """
+        Test sorting both small and large arrays.
+        """
+        rng = np.random.default_rng(0)
+
+        for num_values in [0, 1, 2, 5, 32, 33, 100]:
+            values = rng.integers(0, 10, size=num_values)
+
+            actual = _argsort(values)
+
+            np.testing.assert_equal(values[actual], np.sort(values))
 
     def test_sort_by_area(self):
         """
         Test sorting by area.
         """
-        bounds = np.asarray(
+        bounds = self.make_bounds(
             [
                 [[1, 3], [1, 3], [1, 3]],
                 [[1, 3], [3, 4], [1, 3]],
@@ -268,7 +464,7 @@ class TestStacker(unittest.TestCase):
         """
         Test sorting by height.
         """
-        bounds = np.asarray(
+        bounds = self.make_bounds(
             [
                 [[1, 3], [1, 3], [1, 3]],
                 [[1, 3], [3, 4], [0, 3]],
@@ -286,7 +482,7 @@ class TestStacker(unittest.TestCase):
         """
         Test shadow detection.
         """
-        bounds = np.asarray(
+        array = np.asarray(
             [
                 [[1, 3], [1, 3], [1, 3]],
                 [[2, 3], [2, 4], [2, 3]],
@@ -298,6 +494,7 @@ class TestStacker(unittest.TestCase):
                 [[8, 9], [8, 9], [1, 3]],
             ]
         )
+        bounds = [self.make_bounds(b) for b in array]
 
         # Intersects
         self.assertTrue(is_below(bounds[1], bounds[0], 2))
@@ -318,11 +515,70 @@ class TestStacker(unittest.TestCase):
         # Too far both
         self.assertFalse(is_below(bounds[0], bounds[7], 2))
 
+    def test_get_shadows(self):
+        """
+        Test shadow detection for all bounds at once.
+        """
+        bounds = self.make_bounds(
+            [
+                [[1, 3], [1, 3], [1, 3]],
+                [[2, 3], [2, 4], [4, 5]],
+                [[0, 1], [1, 3], [1, 3]],
+                [[8, 9], [8, 9], [1, 3]],
+                [[2, 9], [0, 2], [0, 1]],
+            ]
+        )
+
+        indptr, indices = get_shadows(bounds, 2)
+
+        np.testing.assert_equal(indptr, [0, 2, 3, 3, 3, 4])
+        np.testing.assert_equal(indices, [1, 4, 0, 0])
+
+    def test_get_shadows_many(self):
+        """
+        Test that shadow detection finds the same overlaps as checking every pair.
+        """
+        rng = np.random.default_rng(0)
+        lo = rng.uniform(0, 20, size=(200, 3))
+        hi = lo + rng.uniform(0, 3, size=(200, 3)) ** 2
+        bounds = Bounds(lo, hi)
+
+        for axis in range(3):
+            indptr, indices = get_shadows(bounds, axis)
+
+            other_axes = [a for a in range(3) if a != axis]
+            overlap = (lo[:, None, other_axes] < hi[None, :, other_axes]) & (
+                hi[:, None, other_axes] > lo[None, :, other_axes]
+            )
+            overlap = overlap.all(axis=-1) & ~np.eye(200, dtype=bool)
+
+            for i in range(200):
+                actual = indices[indptr[i] : indptr[i + 1]]
+                np.testing.assert_equal(actual, np.flatnonzero(overlap[i]))
+
+    def test_single_precision(self):
+        """
+        Test that single precision bounds give single precision results.
+        """
+        bounds = self.make_bounds(
+            np.asarray(
+                [
+                    [[1, 3], [1, 3], [1, 2]],
+                    [[2, 3], [2, 4], [3, 4]],
+                ],
+                dtype=np.float32,
+            )
+        )
+
+        self.assertEqual(drop_down(bounds, 2).dtype, np.float32)
+        base_bounds = get_base(bounds, 2)
+        self.assertEqual(stack_all_above(base_bounds, bounds, 2).dtype, np.float32)
+
     def test_drop_down_above(self):
         """
         Test that objects above others are stacked in columns correctly.
         """
-        bounds = np.asarray(
+        bounds = self.make_bounds(
             [
                 [[1, 3], [1, 3], [1, 2]],
                 [[2, 3], [2, 4], [3, 4]],
@@ -345,7 +601,7 @@ class TestStacker(unittest.TestCase):
         """
         Test that objects not above others are stacked in columns correctly.
         """
-        bounds = np.asarray(
+        bounds = self.make_bounds(
             [
                 [[1, 2], [1, 2], [1, 2]],
                 [[2, 3], [2, 3], [3, 4]],
@@ -369,7 +625,7 @@ class TestStacker(unittest.TestCase):
         Test that drop down ignores non overlapping even when out of order.
         """
         # base, no overlap, overlap
-        bounds = np.asarray(
+        bounds = self.make_bounds(
             [
                 [[0, 1], [0, 1], [0, 1]],
                 [[0, 1], [1, 2], [4, 5]],
@@ -394,7 +650,7 @@ class TestStacker(unittest.TestCase):
         order.
         """
         # base, no overlap, overlap both
-        bounds = np.asarray(
+        bounds = self.make_bounds(
             [
                 [[0, 1], [0, 1], [0, 4]],
                 [[0, 1], [2, 3], [2, 3]],
@@ -418,7 +674,7 @@ class TestStacker(unittest.TestCase):
         Test that drop down does not add padding to the floor.
         """
         # base, no overlap, overlap both
-        bounds = np.asarray(
+        bounds = self.make_bounds(
             [
                 [[0, 1], [0, 1], [0, 4]],
                 [[0, 1], [2, 3], [2, 3]],
@@ -21,7 +21,6 @@ import pathlib
 import numpy as np
 
 import bpy
-from mathutils import Vector
 
 # Setup to let Blender see other .py files
 if not dir in sys.path:
@@ -32,6 +31,28 @@ if not dir in sys.path:
 import stacker
 
 
+def get_corners(obj, corners):
+    """
+    A blender specific helper to get the world coordinates of the corners of an
+    object's bounding box.
+
+    Each of the object's properties is read from Blender exactly once.
+
+    Arguments:
+        obj:     An instance of bpy.types.object.
+        corners: A np.array of shape (8, 4) with a last column of ones, used as
+                 scratch space for the corners in homogeneous coordinates.
+
+    Returns:
+        A np.array of shape (8, 3).
+    """
+    matrix = np.asarray(obj.matrix_world, dtype=np.float32)
+    corners[:, :3] = obj.bound_box
+
+    # homogeneous coordinates, so that one matmul applies the full transform
+    return (corners @ matrix.T)[:, :3]
+
+
 def get_bounds(obj):
     """
     A blender specific helper to get world min and max of an object's bounding box.
@@ -40,25 +61,53 @@ def get_bounds(obj):
         obj:    An instance of bpy.types.object.
 
     Returns:
-        A np.array of shape (3, 2) where the first dimension represents spacial axes
-        and the second dimension is min, max.
+        A stacker.Bounds of shape (3,).
     """
-    corners = np.asarray(
-        [obj.matrix_world @ Vector(corner) for corner in obj.bound_box]
-    )
+    homogeneous = np.ones((8, 4), dtype=np.float32)
 
-    mins = np.min(corners, axis=0, keepdims=True)
-    maxs = np.max(corners, axis=0, keepdims=True)
-
-    # resulting shape is (3, 2)
-    bounds = np.concatenate([mins, maxs], axis=0).T
+    corners = get_corners(obj, homogeneous)
+    mins = np.min(corners, axis=0)
+    maxs = np.max(corners, axis=0)
 
+    # children_recursive already includes every descendant, so no need to recurse
     for child in obj.children_recursive:
-        other = get_bounds(child)
-        bounds[:, 0] = np.minimum(bounds[:, 0], other[:, 0])
-        bounds[:, 1] = np.maximum(bounds[:, 1], other[:, 1])
+        corners = get_corners(child, homogeneous)
+        np.minimum(mins, np.min(corners, axis=0), out=mins)
+        np.maximum(maxs, np.max(corners, axis=0), out=maxs)
+
+    return stacker.Bounds(mins, maxs)
 
-    return bounds
+
+def fill_bounds(objs, out):
+    """
+    A blender specific helper to get the bounds of many objects at once.
+
+    Arguments:
+        objs:   A list of instances of bpy.types.object.
+        out:    A stacker.Bounds of shape (len(objs), 3) to write the bounds into, see
+                stacker.empty_bounds.
+    """
+    for i, obj in enumerate(objs):
+        out.lo[i], out.hi[i] = get_bounds(obj)
+
+
+def translate_objects(objs, deltas):
+    """
+    A blender specific helper to move many objects at once.
+
+    Arguments:
+        objs:   A list of instances of bpy.types.object.
+        deltas: A np.array of shape (len(objs), 3).
+    """
+    locations = np.empty((len(objs), 3), dtype=np.float32)
+    for i, obj in enumerate(objs):
+        locations[i] = obj.location
+
+    locations += deltas
+
+    # assign each row directly rather than adding a new Vector per object
+    for obj, location in zip(objs, locations):
+        obj.location = location
 
 
 class StackerProperties(bpy.types.PropertyGroup):
@@ -115,12 +164,11 @@ class StackerDropDownOperator(bpy.types.Operator):
             self.report({"WARNING"}, "At least two objects need to be selected.")
             return {"CANCELLED"}
 
-        bounds = np.asarray([get_bounds(obj) for obj in objs])
+        bounds = stacker.empty_bounds(len(objs))
+        fill_bounds(objs, bounds)
         deltas = stacker.drop_down(bounds, axis, padding)
 
-        for obj, delta in zip(objs, deltas):
-            prev = stacker.translate_bounds(bounds, delta)
-            obj.location += Vector(delta)
+        translate_objects(objs, deltas)
 
         return {"FINISHED"}
 
@@ -150,12 +198,13 @@ class StackerOperator(bpy.types.Operator):
             return {"CANCELLED"}
 
         if sorting:
-            all_bounds = np.asarray([get_bounds(obj) for obj in objs])
+            all_bounds = stacker.empty_bounds(len(objs))
+            fill_bounds(objs, all_bounds)
             idxs = stacker.argsort_by_area(all_bounds, axis)
             idxs = idxs[::-1]  # Largest first
 
             # Re-order
-            all_bounds = all_bounds[idxs]
+            all_bounds = stacker.Bounds(all_bounds.lo[idxs], all_bounds.hi[idxs])
             objs = [objs[i] for i in idxs]
 
             # Stack on top of the current position of the lowest object
@@ -163,20 +212,21 @@ class StackerOperator(bpy.types.Operator):
         else:
             # Put active object at the front
             objs.sort(key=lambda obj: obj != active_object)
-            all_bounds = [get_bounds(obj) for obj in objs]
+            all_bounds = stacker.empty_bounds(len(objs))
+            fill_bounds(objs, all_bounds)
 
             # Stack on top of the first object
-            first_bounds = all_bounds[0]
+            first_bounds = stacker.Bounds(all_bounds.lo[0], all_bounds.hi[0])
 
             # Don't move first object from where it currently is
             objs = objs[1:]
-            all_bounds = all_bounds[1:]
+            all_bounds = stacker.Bounds(all_bounds.lo[1:], all_bounds.hi[1:])
+
+        deltas = stacker.stack_all_above(
+            first_bounds, all_bounds, axis, padding, centering
+        )
 
-        prev = first_bounds
-        for obj, bounds in zip(objs, all_bounds):
-            delta = stacker.stack_above(prev, bounds, axis, padding, centering)
-            prev = stacker.translate_bounds(bounds, delta)
-            obj.location += Vector(delta)
+        translate_objects(objs, deltas)
 
         return {"FINISHED"}
 
@@ -0,0 +1,131 @@
+"""
+Compiled kernels for the sequential parts of the stacking logic in stacker.py.
+
+Numba is used to compile the kernels when it is installed. Blender's bundled Python
+does not ship with it, so the kernels fall back to running as plain Python.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+
+    def njit(*args, **kwargs):  # pylint: disable=unused-argument
+        """
+        Stand-in for numba.njit which leaves the decorated function as it is.
+        """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+def make_overlap_pairs(first, second):
+    """
+    Returns a kernel testing pairs of bounds for overlap in the two given axes.
+
+    The axes are baked into the kernel as constants, so that each stacking axis gets
+    its own compiled specialisation.
+
+    Arguments:
+        first:  The first axis to test, 0, 1, or 2 for x, y, z.
+        second: The second axis to test, 0, 1, or 2 for x, y, z.
+    """
+
+    @njit(cache=True)
+    def overlap_pairs(lo, hi, rows, cols):
+        """
+        Returns a boolean np.array of shape (num_pairs,), which is True where the
+        bounds in the pair are distinct and overlap.
+
+        Arguments:
+            lo:   A np.array of shape (num_bounds, 3) with the min of each bound.
+            hi:   A np.array of shape (num_bounds, 3) with the max of each bound.
+            rows: A np.array of shape (num_pairs,) with the first bound of each pair.
+            cols: A np.array of shape (num_pairs,) with the second bound of each pair.
+        """
+        overlap = np.empty(rows.shape[0], dtype=np.bool_)
+
+        for m in range(rows.shape[0]):
+            i = rows[m]
+            j = cols[m]
+            overlap[m] = (
+                i != j
+                and lo[i, first] < hi[j, first]
+                and hi[i, first] > lo[j, first]
+                and lo[i, second] < hi[j, second]
+                and hi[i, second] > lo[j, second]
+            )
+
+        return overlap
+
+    return overlap_pairs
+
+
+@njit(cache=True)
+def insertion_argsort(values):
+    """
+    Returns the indices that would sort the given values, using a stable insertion
+    sort. Only suitable for a handful of values.
+
+    Arguments:
+        values: A np.array of shape (num_values,).
+    """
+    order = np.arange(values.shape[0])
+
+    for k in range(1, values.shape[0]):
+        idx = order[k]
+
+        m = k
+        while m > 0 and values[order[m - 1]] > values[idx]:
+            order[m] = order[m - 1]
+            m -= 1
+
+        order[m] = idx
+
+    return order
+
+
+@njit(cache=True, fastmath=True)
+def drop_down_sweep(bottoms, tops, indptr, indices, order, padding, output):
+    """
+    Writes the amount that each bound should be translated in the stacking axis in
+    order to be dropped onto the bounds below it.
+
+    The given bounds are left as they are, the current position of each bound is its
+    original position plus its output.
+
+    Arguments:
+        bottoms: A np.array of shape (num_bounds,) with the start of each bound in the
+                 stacking axis.
+        tops:    A np.array of shape (num_bounds,) with the end of each bound in the
+                 stacking axis.
+        indptr:  Row pointers of the overlapping bounds, see stacker.get_shadows.
+        indices: Column indices of the overlapping bounds, see stacker.get_shadows.
+        order:   Indices of the bounds sorted by height, lowest first.
+        padding: Extra space to put between each object.
+        output:  A np.array of shape (num_bounds,) filled with zeros, to write to.
+    """
+    num_bounds = order.shape[0]
+
+    placed = np.zeros(num_bounds, dtype=np.bool_)
+    placed[order[0]] = True
+
+    floor_top = bottoms[order[0]]
+
+    for k in range(1, num_bounds):
+        i = order[k]
+
+        # highest placed bound overlapping this one and not entirely above it
+        target_top = floor_top
+        for m in range(indptr[i], indptr[i + 1]):
+            j = indices[m]
+            if not placed[j] or bottoms[j] + output[j] > tops[i]:
+                continue
+            if tops[j] + output[j] > target_top:
+                target_top = tops[j] + output[j]
+
+        output[i] = target_top - bottoms[i]
+        if target_top > floor_top:
+            output[i] += padding
+
+        placed[i] = True